@@ -1,29 +1,34 @@
+from functools import lru_cache
+
 from langchain_ollama import ChatOllama
 from langchain_openai import ChatOpenAI
-from src.settings import settings
+from src.settings import get_settings
 from src.types import LLMProvider
 
 def get_ollama():
     llm_ollama = ChatOllama(
-        model=settings.ollama_model_id,
+        model=get_settings().ollama_model_id,
         temperature=0.3,
     )
     return llm_ollama
 
-def get_openai():
+def get_openai(api_key: str | None = None):
     llm_openai = ChatOpenAI(
         model="gpt-5-mini",
         temperature=0.3,
         timeout=None,
         max_retries=2,
-        api_key=settings.openai_api_key
+        api_key=api_key or get_settings().openai_api_key,
+        # Route requests sharing the PII extraction system prompt to the same prompt cache
+        model_kwargs={"prompt_cache_key": "pii-extract-v1"}
     )
     return llm_openai
 
-def get_llm(provider: LLMProvider):
+@lru_cache(maxsize=4)
+def get_llm(provider: LLMProvider, api_key: str | None = None):
     if provider == LLMProvider.OLLAMA:
         return get_ollama()
     elif provider == LLMProvider.OPENAI:
-        return get_openai()
+        return get_openai(api_key)
     else:
         raise ValueError(f"Unsupported LLM provider: {provider}")
\ No newline at end of file
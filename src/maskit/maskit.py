@@ -1,4 +1,18 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import numpy as np
 import pymupdf
+import tiktoken
+from collections.abc import AsyncIterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import cached_property, lru_cache
+from dataclasses import dataclass
+from pathlib import Path
 from src.llms import get_llm
 from src.types import LLMProvider
 from argparse import ArgumentParser
@@ -12,63 +26,453 @@ class EntityType(str, Enum):
     ADDRESS = "address"
     ACCOUNT_NUMBER = "account_number"
     
+@dataclass(slots=True, frozen=True)
+class PIIEntityLite:
+    """Lightweight, hashable PIIEntity. `PIIEntity` is only used to validate LLM outputs,
+    entities are converted to this right after parsing and used everywhere else."""
+    text: str
+    type: EntityType
+
 class PIIEntity(BaseModel):
     text: str = Field(..., description="The text of the PII entity")
     type: EntityType = Field(..., description="The type of the PII entity (e.g., name, email, etc.)")
 
+    def to_lite(self) -> PIIEntityLite:
+        return PIIEntityLite(text=self.text, type=self.type)
+
 class PIIEntities(BaseModel):
     entities: list[PIIEntity] = Field(..., description="List of PII entities extracted from the document")
+    
+    def to_lite(self) -> list[PIIEntityLite]:
+        return [entity.to_lite() for entity in self.entities]
+
+# Cheap check for text that may contain PII: an email, a phone number or two capitalized words
+PII_CANDIDATE_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+|\b\d{3}[-.\s]?\d{3}[-.\s]?\d{4}\b|[A-Z][a-z]+\s+[A-Z][a-z]+")
+
+# PII with a strict grammar, extracted with regexes instead of the LLM
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+# Phone numbers. Groups must follow a known shape, so reference numbers like 2024-001-0001 or
+# 12 345 6789 don't match, and they can't be part of a longer run of digit groups or follow a '#'
+PHONE_RE = re.compile(r"""
+    (?<![\w+#])(?<!\d[\s.-])
+    (?:
+        \+[1-9]\d{6,14}                                              # E.164: +14155552671
+      | \+[1-9]\d{0,2}[\s.-]?(?:\(\d{1,4}\)|\d{1,4})(?:[\s.-]?\d{2,4}){1,4}  # international: +44 20 7946 0958
+      | (?:1[\s.-]?)?\(\d{3}\)[\s.-]?\d{3}[\s.-]?\d{4}              # (415) 555-2671
+      | (?:1[\s.-])?\d{3}[\s.-]\d{3}[\s.-]\d{4}                     # 415-555-2671, 1-800-555-0199
+      | 1?[2-9]\d{9}                                                 # 4155552671
+      | [2-9]\d{2}[\s.-]\d{4}                                        # local: 555-1234 (exchange codes never start with 0/1)
+    )
+    (?!\w)(?![\s.-]\d)
+""", re.VERBOSE)
+# Runs of 15+ digits, optionally grouped with spaces/dashes. Card-like account numbers are the
+# Luhn valid prefixes of these (see `_account_number`), the rest may be e.g. an expiry date
+ACCOUNT_NUMBER_RE = re.compile(r"(?<![\w-])\d(?:[ -]?\d){14,}(?![\w-])")
+
+def _luhn_valid(digits: str) -> bool:
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        value = int(digit) * (2 if i % 2 else 1)
+        total += value - 9 if value > 9 else value
+    return total % 10 == 0
+
+def _account_number(digit_groups: str) -> str | None:
+    """Longest prefix of a run of digit groups ending on a group boundary, with 15 to 19 digits and Luhn valid"""
+    for group_end in reversed([match.end() for match in re.finditer(r"\d+", digit_groups)]):
+        digits = re.sub(r"\D", "", digit_groups[:group_end])
+        if 15 <= len(digits) <= 19 and _luhn_valid(digits):
+            return digit_groups[:group_end]
+    return None
+
+@lru_cache
+def _get_openai_encoding() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model("gpt-4o-mini")
+
+_event_loop_lock = threading.Lock()
+
+@lru_cache
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Event loop running forever in a daemon thread, shared by all async LLM calls of the process.
+    
+    LLM clients are cached and reused (see `get_llm`), and so are their pooled connections, which are
+    bound to the loop that opened them. A new loop per extraction (`asyncio.run`) fails on them with
+    "Event loop is closed" once the previous loop is gone.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="maskit-event-loop", daemon=True).start()
+    return loop
+
+def submit_coroutine(coro) -> Future:
+    """Schedule a coroutine on the shared event loop, from any thread (even one already running a loop)"""
+    # Locked so concurrent first calls don't start two loops
+    with _event_loop_lock:
+        loop = _get_event_loop()
+    return asyncio.run_coroutine_threadsafe(coro, loop)
 
 class Masker:
-    def __init__(self, llm_provider: LLMProvider):
-        self.llm = get_llm(llm_provider)
+    # Rough upper bound (in tokens) for sending all pages in a single LLM call
+    MAX_BATCH_TOKENS = 8000
+    # Max number of concurrent per-page LLM calls
+    MAX_CONCURRENCY = 10
+    # Pages shorter than this (in chars) are only sent to the LLM if they contain a PII candidate
+    MIN_PAGE_CHARS = 200
+    # Max size (in tokens) of the text sent in a single per-page LLM call
+    MAX_CHUNK_TOKENS = 3000
+    # Min number of uncached pages for their text to be extracted in parallel worker processes
+    PARALLEL_MIN_PAGES = 32
+    # Always sent first and never changes, so providers can reuse it as a cached prompt prefix
+    # (OpenAI caches prefixes of 1024+ tokens automatically, Ollama reuses the KV cache of an
+    # identical prefix when the model stays loaded). The page text must only go after it.
+    SYSTEM_MESSAGE = {
+        "role": "system",
+        "content": (
+            "You are a helpful assistant that extracts personally identifiable information (PII) from text. "
+            "Identify names, emails, phone numbers, addresses, and account numbers.\n"
+            "Rules:\n"
+            "- Copy each entity exactly as it appears in the text, without reformatting it.\n"
+            "- Report each distinct entity once, even if it appears several times.\n"
+            "- Lines like '=== PAGE n ===' are page delimiters, not part of the document."
+        )
+    }
+    
+    def __init__(self, llm_provider: LLMProvider, api_key: str | None = None, llm=None,
+                 page_text_cache: dict[int, str] | None = None, page_chars_cache: dict[int, tuple[str, np.ndarray, np.ndarray]] | None = None):
+        self.llm_provider = llm_provider
+        self.llm = llm if llm is not None else get_llm(llm_provider, api_key)
+        # Page index -> extracted text, for the document currently being processed
+        self._page_text_cache = page_text_cache if page_text_cache is not None else {}
+        # Page index -> (page string, bbox and line of each of its chars), for the same document
+        self._page_chars_cache = page_chars_cache if page_chars_cache is not None else {}
+    
+    # Bound on first use (not in __init__), so creating a Masker that never calls the LLM stays cheap,
+    # then reused rather than rebinding the output schema on every LLM call
+    @cached_property
+    def _structured_llm(self):
+        return self.llm.with_structured_output(PIIEntities)
+    
+    @cached_property
+    def _streaming_structured_llm(self):
+        # A JSON schema (rather than the pydantic model) makes the output parser yield partial results
+        return self.llm.with_structured_output(PIIEntities.model_json_schema())
     
-    def _invoke_llm_for_pii_extraction(self, text: str) -> PIIEntities:
-        llm_structured = self.llm.with_structured_output(PIIEntities)
+    @staticmethod
+    def _flatten_chars(rawdict: dict) -> tuple[str, np.ndarray, np.ndarray]:
+        """Flatten a rawdict into the page string, with an (n, 4) array of char bboxes and an (n,) array of line numbers"""
+        chars, bboxes, lines = [], [], []
+        line_no = 0
+        for block in rawdict["blocks"]:
+            # Image blocks have no lines
+            for line in block.get("lines", []):
+                for span in line["spans"]:
+                    for char in span["chars"]:
+                        chars.append(char["c"])
+                        bboxes.append(char["bbox"])
+                        lines.append(line_no)
+                # Lines are separated by a space belonging to no line, so entities wrapping across lines still match
+                chars.append(" ")
+                bboxes.append((np.nan,) * 4)
+                lines.append(-1)
+                line_no += 1
+        return "".join(chars), np.array(bboxes, dtype=np.float32).reshape(-1, 4), np.array(lines, dtype=np.int32)
+    
+    @classmethod
+    def _extract_page_text(cls, page) -> tuple[str, tuple[str, np.ndarray, np.ndarray]]:
+        """Extract both the plain text and the char layout of a page from a single TextPage"""
+        # Same flags as `page.get_text()`: clip to the mediabox, keep ligatures and whitespace as is
+        textpage = page.get_textpage(flags=pymupdf.TEXTFLAGS_TEXT)
+        return page.get_text(textpage=textpage), cls._flatten_chars(page.get_text("rawdict", textpage=textpage))
+    
+    def _load_page_text(self, page) -> None:
+        self._page_text_cache[page.number], self._page_chars_cache[page.number] = self._extract_page_text(page)
+    
+    def _prefetch_page_text(self, doc, page_indices: range) -> None:
+        """Extract the text of many uncached pages at once, spread over worker processes"""
+        missing = [page_index for page_index in page_indices
+                   if page_index not in self._page_text_cache or page_index not in self._page_chars_cache]
+        workers = min(os.cpu_count() or 1, len(missing) // self.PARALLEL_MIN_PAGES + 1)
+        if len(missing) < self.PARALLEL_MIN_PAGES or workers < 2:
+            return
         
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant that extracts personally identifiable information (PII) from text. Identify names, emails, phone numbers, addresses, and account numbers."},
-            {"role": "user", "content": text}
-        ]
-        entities = llm_structured.invoke(messages)
+        # pymupdf is not thread safe, so each worker process opens its own copy of the document.
+        # Docs opened from bytes keep them in `stream`, only serialize the document if there are none
+        pdf = doc.name or doc.stream or doc.tobytes()
+        page_groups = [missing[worker::workers] for worker in range(workers)]
+        # Forking a multi-threaded process (like the Streamlit server) can deadlock, start clean workers instead
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method)) as executor:
+            for pages in executor.map(_extract_pages_text, [pdf] * workers, page_groups):
+                for page_index, (page_text, page_chars) in pages.items():
+                    self._page_text_cache[page_index] = page_text
+                    self._page_chars_cache[page_index] = page_chars
+    
+    def _get_page_text(self, doc, page_index: int) -> str:
+        if page_index not in self._page_text_cache:
+            self._load_page_text(doc.load_page(page_index))
+        return self._page_text_cache[page_index]
+    
+    def _get_page_chars(self, page) -> tuple[str, np.ndarray, np.ndarray]:
+        if page.number not in self._page_chars_cache:
+            self._load_page_text(page)
+        return self._page_chars_cache[page.number]
+    
+    async def _ainvoke_llm_for_pii_extraction(self, text: str) -> PIIEntities:
+        messages = [self.SYSTEM_MESSAGE, {"role": "user", "content": text}]
+        entities = await self._structured_llm.ainvoke(messages)
         
         return entities
     
-    def extract_pii(self, doc, **kwargs) -> list[PIIEntity]:
+    def _count_tokens(self, text: str) -> int:
+        if self.llm_provider == LLMProvider.OPENAI:
+            return len(_get_openai_encoding().encode(text))
+        # No tokenizer for arbitrary Ollama models, roughly 4 chars per token. Rounded up, so the
+        # counts of the parts of a text never add up to less than the count of the whole text
+        return -(-len(text) // 4)
+    
+    def _chunk_text(self, text: str, max_tokens: int | None = None, separators: tuple[str, ...] = ("\n\n", "\n", " ")) -> list[str]:
+        """Split text into chunks of at most max_tokens, on paragraph boundaries (or lines/words for huge paragraphs).
+        Separators are kept at the end of the chunks, so joining the chunks gives back the text"""
+        max_tokens = max_tokens or self.MAX_CHUNK_TOKENS
+        if self._count_tokens(text) <= max_tokens:
+            return [text]
+        if not separators:
+            # A word larger than a chunk, split it anywhere. A char is at most 4 bytes, so at most 4 tokens
+            chunk_chars = max(max_tokens // 4, 1)
+            return [text[start:start + chunk_chars] for start in range(0, len(text), chunk_chars)]
+        
+        separator, *finer_separators = separators
+        chunks = []
+        current, current_tokens = [], 0
+        # Split after each separator, keeping it with the part before it
+        for part in re.split(f"(?<={re.escape(separator)})", text):
+            if not part:
+                continue
+            part_tokens = self._count_tokens(part)
+            if current and current_tokens + part_tokens > max_tokens:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            if part_tokens > max_tokens:
+                chunks.extend(self._chunk_text(part, max_tokens, tuple(finer_separators)))
+            else:
+                current.append(part)
+                current_tokens += part_tokens
+        if current:
+            chunks.append("".join(current))
+        return chunks
+    
+    async def _aextract_pii(self, page_texts: list[str]) -> list[PIIEntityLite]:
+        """Extract PII from each page concurrently, in groups of MAX_CONCURRENCY pages"""
+        # Split large pages, so no single call exceeds the model context
+        page_texts = [chunk for page_text in page_texts for chunk in self._chunk_text(page_text)]
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENCY)
+        
+        async def _extract_page(text: str) -> PIIEntities:
+            async with semaphore:
+                return await self._ainvoke_llm_for_pii_extraction(text)
+        
         pii_entities = []
+        for start in range(0, len(page_texts), self.MAX_CONCURRENCY):
+            batch = page_texts[start:start + self.MAX_CONCURRENCY]
+            results = await asyncio.gather(*(_extract_page(text) for text in batch), return_exceptions=True)
+            for result in results:
+                # A failed page would leave its PII unmasked, so surface the error
+                if isinstance(result, BaseException):
+                    raise result
+                pii_entities.extend(result.to_lite())
+        
+        return pii_entities
+    
+    async def _astream_llm_for_pii_extraction(self, text: str) -> AsyncIterator[PIIEntityLite]:
+        """Yield PII entities as soon as each one is fully generated by the LLM"""
+        messages = [self.SYSTEM_MESSAGE, {"role": "user", "content": text}]
+        emitted = 0
+        entities = []
+        async for partial in self._streaming_structured_llm.astream(messages):
+            entities = (partial or {}).get("entities") or []
+            # The last entity may still be incomplete, it is emitted once the next one starts
+            while emitted < len(entities) - 1:
+                yield PIIEntity.model_validate(entities[emitted]).to_lite()
+                emitted += 1
+        
+        for entity in entities[emitted:]:
+            yield PIIEntity.model_validate(entity).to_lite()
+    
+    def _may_contain_pii(self, text: str) -> bool:
+        return len(text) >= self.MIN_PAGE_CHARS or PII_CANDIDATE_RE.search(text) is not None
+    
+    @staticmethod
+    def _get_page_range(doc, **kwargs) -> range:
         from_page = int(kwargs.get("from_page_no", 1)) - 1 if kwargs.get("from_page_no") else 0
         to_page = int(kwargs.get("to_page_no", doc.page_count)) if kwargs.get("to_page_no") else doc.page_count
+        return range(from_page, to_page)
+    
+    @staticmethod
+    def _regex_pii(text: str) -> list[PIIEntityLite]:
+        """Extract emails, phone numbers and card-like account numbers from text"""
+        pii_entities = []
+        account_spans = []
+        for match in ACCOUNT_NUMBER_RE.finditer(text):
+            account_spans.append(match.span())
+            # The card number may be followed by other digit groups, like its expiry date
+            account_number = _account_number(match.group())
+            if account_number:
+                pii_entities.append(PIIEntityLite(text=account_number, type=EntityType.ACCOUNT_NUMBER))
+        for match in PHONE_RE.finditer(text):
+            # Digit groups of a long number (Luhn valid or not) can look like a phone number
+            if not any(start < match.end() and match.start() < end for start, end in account_spans):
+                pii_entities.append(PIIEntityLite(text=match.group(), type=EntityType.PHONE))
+        for match in EMAIL_RE.finditer(text):
+            pii_entities.append(PIIEntityLite(text=match.group(), type=EntityType.EMAIL))
+        return pii_entities
+    
+    def regex_pii(self, doc, **kwargs) -> list[PIIEntityLite]:
+        """Extract the PII types with a strict grammar from the requested pages, without the LLM"""
+        page_range = self._get_page_range(doc, **kwargs)
+        self._prefetch_page_text(doc, page_range)
+        pii_entities = []
+        for page_index in page_range:
+            pii_entities.extend(self._regex_pii(self._get_page_text(doc, page_index)))
+        return self._dedup_entities(pii_entities)
+    
+    def _get_pages(self, doc, **kwargs) -> dict[int, str]:
+        """Return the text of each requested page that may contain PII, keyed by page index"""
+        page_range = self._get_page_range(doc, **kwargs)
         
-        for page_index in range(from_page, to_page):
-            page = doc.load_page(page_index)
-            page_text = page.get_text()
-            page_pii = self._invoke_llm_for_pii_extraction(page_text)
-            pii_entities.extend(page_pii.entities)
+        self._prefetch_page_text(doc, page_range)
+        pages = {}
+        for page_index in page_range:
+            page_text = self._get_page_text(doc, page_index)
+            # Skip short pages without any PII candidate (blank, numeric tables, boilerplate)
+            if self._may_contain_pii(page_text):
+                pages[page_index] = page_text
+        return pages
+    
+    def get_page_texts(self, doc, **kwargs) -> tuple[list[str], str]:
+        """Return the text of each requested page that may contain PII, and all of them joined with page delimiters"""
+        pages = self._get_pages(doc, **kwargs)
+        full_text = "\n\n".join(f"=== PAGE {page_index + 1} ===\n{text}" for page_index, text in pages.items())
+        return list(pages.values()), full_text
+    
+    async def astream_pii_from_pages(self, page_texts: list[str], full_text: str,
+                                     regex_entities: list[PIIEntityLite] = ()) -> AsyncIterator[PIIEntityLite]:
+        """Yield unique PII entities as they are extracted: `regex_entities` (from `regex_pii`) first, then the
+        LLM extracted ones from the output of `get_page_texts`. Doesn't use pymupdf, so it can run in any thread"""
+        seen = set()
+        for entity in regex_entities:
+            if entity not in seen:
+                seen.add(entity)
+                yield entity
+        if not page_texts:
+            return
         
-        return pii_entities
+        if self._count_tokens(full_text) <= self.MAX_BATCH_TOKENS:
+            # Single LLM call for all pages
+            pii_entities = self._astream_llm_for_pii_extraction(full_text)
+        else:
+            # Too large for one call, fall back to concurrent per-page (or per-chunk) calls.
+            # These can't be streamed entity by entity, yield once all are done
+            async def _extracted() -> AsyncIterator[PIIEntityLite]:
+                for entity in await self._aextract_pii(page_texts):
+                    yield entity
+            pii_entities = _extracted()
+        
+        async for entity in pii_entities:
+            if entity not in seen:
+                seen.add(entity)
+                yield entity
+    
+    def extract_pii(self, doc, **kwargs) -> list[PIIEntityLite]:
+        page_texts, full_text = self.get_page_texts(doc, **kwargs)
+        regex_entities = self.regex_pii(doc, **kwargs)
+        
+        async def _collect() -> list[PIIEntityLite]:
+            return [entity async for entity in self.astream_pii_from_pages(page_texts, full_text, regex_entities)]
+        
+        return submit_coroutine(_collect()).result()
+    
+    @staticmethod
+    def _dedup_entities(entities: list[PIIEntityLite]) -> list[PIIEntityLite]:
+        return list(dict.fromkeys(entities))
 
-    def highlight_pii(self, doc, entities: list[PIIEntity]) -> bytes:
-        if entities:
+    @staticmethod
+    def _unique_by_text(entities: list[PIIEntityLite]) -> list[PIIEntityLite]:
+        """Drop entities with the same (case/whitespace-insensitive) text, longest first"""
+        unique = {" ".join(entity.text.lower().split()): entity for entity in entities}
+        # Longer spans first, so they win over entities that are substrings of them
+        return sorted(unique.values(), key=lambda entity: len(entity.text), reverse=True)
+    
+    @staticmethod
+    def _build_pii_pattern(entities: list[PIIEntityLite]) -> re.Pattern | None:
+        """Build a single regex matching any of the entity texts, one named group per entity"""
+        alternatives = []
+        for entity_index, entity in enumerate(entities):
+            # Match any whitespace (incl. line breaks) between words
+            words = entity.text.split()
+            if words:
+                entity_pattern = r"\s+".join(map(re.escape, words))
+                alternatives.append(f"(?P<e{entity_index}>{entity_pattern})")
+        return re.compile("|".join(alternatives), re.IGNORECASE) if alternatives else None
+    
+    def _find_pii_instances(self, page, pattern: re.Pattern, entities: list[PIIEntityLite]) -> list[tuple[pymupdf.Rect, PIIEntityLite]]:
+        """Find all entity occurrences on a page in a single pass over its text"""
+        page_str, char_bboxes, char_lines = self._get_page_chars(page)
+        
+        instances = []
+        for match in pattern.finditer(page_str):
+            entity = entities[int(match.lastgroup[1:])]
+            bboxes = char_bboxes[match.start():match.end()]
+            lines = char_lines[match.start():match.end()]
+            
+            # One rect per line, so matches wrapping across lines don't cover the text in between
+            for line in np.unique(lines[lines >= 0]):
+                line_bboxes = bboxes[lines == line]
+                rect = pymupdf.Rect(*line_bboxes[:, :2].min(axis=0), *line_bboxes[:, 2:].max(axis=0))
+                instances.append((rect, entity))
+        
+        return instances
+
+    def highlight_pii(self, doc, entities: list[PIIEntityLite]) -> bytes:
+        entities = self._unique_by_text(entities or [])
+        pattern = self._build_pii_pattern(entities)
+        if pattern:
+            self._prefetch_page_text(doc, range(doc.page_count))
             for page in doc:
-                for entity in entities:
-                    text_instances = page.search_for(entity.text)
-                    for inst in text_instances:
-                        highlight = page.add_highlight_annot(inst)
-                        highlight.set_info(content=f"PII Type: {entity.type}")
+                for rect, entity in self._find_pii_instances(page, pattern, entities):
+                    highlight = page.add_highlight_annot(rect)
+                    highlight.set_info(content=f"PII Type: {entity.type}")
         return doc.convert_to_pdf()
 
-    def redact_pii(self, doc, entities: list[PIIEntity]) -> bytes:
-        if entities:
+    def redact_pii(self, doc, entities: list[PIIEntityLite]) -> bytes:
+        entities = self._unique_by_text(entities or [])
+        pattern = self._build_pii_pattern(entities)
+        if pattern:
+            self._prefetch_page_text(doc, range(doc.page_count))
+            # Annotations are added and applied sequentially, in this process only
             for page in doc:
-                for entity in entities:
-                    text_instances = page.search_for(entity.text)
-                    for inst in text_instances:
-                        page.add_redact_annot(inst, fill=(0, 0, 0))
-                page.apply_redactions()
+                instances = self._find_pii_instances(page, pattern, entities)
+                for rect, _ in instances:
+                    page.add_redact_annot(rect, fill=(0, 0, 0))
+                if instances:
+                    # Only text is removed: images and vector graphics under the redacted
+                    # areas are left untouched, so PII rendered inside images is not scrubbed
+                    page.apply_redactions(images=pymupdf.PDF_REDACT_IMAGE_NONE,
+                                          graphics=pymupdf.PDF_REDACT_LINE_ART_NONE)
         return doc.convert_to_pdf()
     
+    def _reset_page_cache(self):
+        """Forget cached page text/words, must be called before processing another document"""
+        self._page_text_cache.clear()
+        self._page_chars_cache.clear()
+    
+    def _apply(self, doc, entities: list[PIIEntityLite], **kwargs) -> bytes:
+        if kwargs.get("highlight_only"):
+            # Highlight entities in the document
+            return self.highlight_pii(doc, entities)
+        # Redact entities in the document
+        return self.redact_pii(doc, entities)
+    
     def mask(self, **kwargs) -> bytes:
         self.kwargs = kwargs
+        self._reset_page_cache()
         
         # if pdf is already given:
         if kwargs.get("input_pdf"):
@@ -78,33 +482,137 @@ class Masker:
         
         entities_to_redact = self.extract_pii(doc, **kwargs)
 
-        if kwargs.get("highlight_only"):
-            # Highlight entities in the document
-            doc = self.highlight_pii(doc, entities_to_redact)
-        else:
-            # Redact entities in the document
-            doc = self.redact_pii(doc, entities_to_redact)
-
         # Return redacted PDF
-        return doc
+        return self._apply(doc, entities_to_redact, **kwargs)
+    
+    def mask_many(self, input_paths: list[Path], **kwargs) -> dict[Path, bytes]:
+        """Mask several PDF files, returns the masked PDF bytes keyed by input path"""
+        return {input_path: self.mask(**{**kwargs, "input_pdf": None, "input_path": input_path})
+                for input_path in input_paths}
+
+def _extract_pages_text(pdf: str | bytes, page_indices: list[int]) -> dict[int, tuple[str, tuple[str, np.ndarray, np.ndarray]]]:
+    """Worker process entry point of `Masker._prefetch_page_text`"""
+    doc = pymupdf.open(pdf) if isinstance(pdf, str) else pymupdf.open(stream=pdf, filetype="pdf")
+    return {page_index: Masker._extract_page_text(doc.load_page(page_index)) for page_index in page_indices}
+
+class BatchMasker(Masker):
+    """Masker extracting PII through the OpenAI Batch API, for offline bulk jobs.
+    
+    Half the cost of regular requests, but a batch can take up to 24h to complete.
+    """
+    POLL_INTERVAL_SECONDS = 30
+    
+    def __init__(self, api_key: str | None = None):
+        super().__init__(LLMProvider.OPENAI, api_key)
+        # Reuse the OpenAI client and model configured for ChatOpenAI
+        self.client = self.llm.root_client
+    
+    def _build_request(self, custom_id: str, text: str) -> dict:
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.llm.model_name,
+                "temperature": self.llm.temperature,
+                "messages": [self.SYSTEM_MESSAGE, {"role": "user", "content": text}],
+                "response_format": {
+                    "type": "json_schema",
+                    "json_schema": {"name": "PIIEntities", "schema": PIIEntities.model_json_schema()},
+                },
+            },
+        }
+    
+    def _run_batch(self, requests: list[dict]) -> dict[str, PIIEntities]:
+        """Submit requests as one batch, wait for it to finish, and return the parsed results by custom_id"""
+        jsonl = "\n".join(json.dumps(request) for request in requests).encode("utf-8")
+        input_file = self.client.files.create(file=("pii_requests.jsonl", jsonl), purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id,
+                                           endpoint="/v1/chat/completions",
+                                           completion_window="24h")
+        
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self.POLL_INTERVAL_SECONDS)
+            batch = self.client.batches.retrieve(batch.id)
+        
+        if batch.status != "completed" or batch.error_file_id or not batch.output_file_id:
+            # Any failed request would leave a page unmasked
+            raise RuntimeError(f"PII extraction batch {batch.id} did not fully succeed (status: {batch.status})")
+        
+        results = {}
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            result = json.loads(line)
+            content = result["response"]["body"]["choices"][0]["message"]["content"]
+            results[result["custom_id"]] = PIIEntities.model_validate_json(content)
+        return results
+    
+    def extract_pii_many(self, docs: list, **kwargs) -> list[list[PIIEntityLite]]:
+        """Extract PII from all pages of several documents with a single batch, one request per page chunk"""
+        requests = []
+        pii_entities = []
+        for doc_index, doc in enumerate(docs):
+            self._reset_page_cache()
+            pii_entities.append(self.regex_pii(doc, **kwargs))
+            for page_index, page_text in self._get_pages(doc, **kwargs).items():
+                # Split large pages, a single request over the model context would fail the whole batch
+                for chunk_index, chunk in enumerate(self._chunk_text(page_text)):
+                    requests.append(self._build_request(f"{doc_index}-{page_index}-{chunk_index}", chunk))
+        self._reset_page_cache()
+        
+        results = self._run_batch(requests) if requests else {}
+        
+        for custom_id, chunk_pii in results.items():
+            doc_index = int(custom_id.split("-")[0])
+            pii_entities[doc_index].extend(chunk_pii.to_lite())
+        return [self._dedup_entities(entities) for entities in pii_entities]
+    
+    def extract_pii(self, doc, **kwargs) -> list[PIIEntityLite]:
+        return self.extract_pii_many([doc], **kwargs)[0]
+    
+    def mask_many(self, input_paths: list[Path], **kwargs) -> dict[Path, bytes]:
+        docs = [pymupdf.open(input_path) for input_path in input_paths]
+        entities_per_doc = self.extract_pii_many(docs, **kwargs)
+        
+        masked = {}
+        for input_path, doc, entities in zip(input_paths, docs, entities_per_doc):
+            self._reset_page_cache()
+            masked[input_path] = self._apply(doc, entities, **kwargs)
+        return masked
 
 if __name__ == "__main__":
     parser = ArgumentParser(description="Redact text in a PDF file")
     parser.add_argument("--input_path", help="Input PDF file path")
     parser.add_argument("--input_pdf", help="Input PDF")
-    parser.add_argument("--output_pdf", required=True, help="Output PDF file path")
+    parser.add_argument("--output_pdf", help="Output PDF file path")
+    parser.add_argument("--input_dir", help="Directory of input PDF files, to mask all of them")
+    parser.add_argument("--output_dir", help="Directory to write the masked PDFs to, when --input_dir is used")
     parser.add_argument("--llm_provider", required=True, help="LLM provider to use for PII extraction. Currently supports 'openai' and 'ollama'")
     parser.add_argument("--from_page_no", default=None, help="From page number to start redaction, Defaults to the first page if not provided")
     parser.add_argument("--to_page_no", default=None, help="To page number to end redaction, Defaults to the last page if not provided")
     parser.add_argument("--highlight_only", action="store_true", help="Only highlight PII entities without redaction")
+    parser.add_argument("--batch", action="store_true", help="Extract PII through the OpenAI Batch API (cheaper, but can take up to 24h). Requires --llm_provider openai")
 
     args = parser.parse_args()
+    if args.input_dir and not args.output_dir:
+        parser.error("--output_dir is required with --input_dir")
+    if not args.input_dir and not args.output_pdf:
+        parser.error("--output_pdf is required")
+    if args.batch and LLMProvider(args.llm_provider) != LLMProvider.OPENAI:
+        parser.error("--batch is only supported with --llm_provider openai")
     
     # convert args to dict and pass to masker.mask()
     args = vars(args)
 
-    masker = Masker(LLMProvider(args["llm_provider"]))
-    masker.mask(**args)
+    masker = BatchMasker() if args["batch"] else Masker(LLMProvider(args["llm_provider"]))
+    if args["input_dir"]:
+        output_dir = Path(args["output_dir"])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        masked = masker.mask_many(sorted(Path(args["input_dir"]).glob("*.pdf")), **args)
+        for input_path, masked_pdf in masked.items():
+            (output_dir / input_path.name).write_bytes(masked_pdf)
+    else:
+        Path(args["output_pdf"]).write_bytes(masker.mask(**args))
     
     # Usage example:
-    # python src/maskit/maskit.py --input_pdf ../src/data/sample.pdf --output_pdf ../src/data/sample_redacted.pdf --llm_provider openai
\ No newline at end of file
+    # python src/maskit/maskit.py --input_pdf ../src/data/sample.pdf --output_pdf ../src/data/sample_redacted.pdf --llm_provider openai
+    # python src/maskit/maskit.py --input_dir ../src/data/in --output_dir ../src/data/out --llm_provider openai --batch
\ No newline at end of file
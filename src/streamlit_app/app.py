@@ -1,17 +1,21 @@
 import base64
 
+import numpy as np
 import streamlit as st
 import pymupdf
 import time
-from src.maskit.maskit import Masker, PIIEntity
-from src.settings import settings
+from src.llms import get_llm
+from src.maskit.maskit import EntityType, Masker, PIIEntityLite, submit_coroutine
 from src.types import LLMProvider
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 import traceback
-from io import BytesIO
+from concurrent.futures import Future
+from typing import Any
 
 class SessionState(BaseModel):
     """Session state class"""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    
     llm_provider: LLMProvider | None = Field(default=LLMProvider.OLLAMA, description="LLM provider selected by user")
     api_key: str | None = Field(default=None, description="API key for LLM provider")
     from_page_no: int | None = Field(default=None, description="From page number for processing")
@@ -19,18 +23,55 @@ class SessionState(BaseModel):
     input_pdf: bytes | None = Field(default=None, description="Uploaded PDF file bytes")
     highlighted_pdf: bytes | None = Field(default=None, description="PDF bytes with highlighted PIIs")
     masked_pdf: bytes | None = Field(default=None, description="PDF bytes with redacted PIIs")
-    entities: list[PIIEntity] | None = Field(default=None, description="List of PII entities extracted from the document")
+    entities: list[PIIEntityLite] | None = Field(default=None, description="List of PII entities extracted from the document")
+    pdf_file_id: str | None = Field(default=None, description="File id of the upload the cached bytes and document belong to")
+    pdf_bytes: bytes | None = Field(default=None, description="Bytes of the uploaded PDF, read once per upload")
+    doc: pymupdf.Document | None = Field(default=None, description="Opened document for the uploaded PDF")
+    page_text_cache: dict[int, str] = Field(default_factory=dict, description="Extracted page text of the uploaded PDF, keyed by page index")
+    page_chars_cache: dict[int, tuple[str, np.ndarray, np.ndarray]] = Field(default_factory=dict, description="Char layout of the uploaded PDF pages, keyed by page index")
+    llm: Any = Field(default=None, description="LLM client, reused across reruns")
+    llm_key: tuple[LLMProvider, str | None] | None = Field(default=None, description="(provider, API key) the LLM client was created for")
+    extraction: Future | None = Field(default=None, description="PII extraction running in the background, if any")
+    extraction_error: str | None = Field(default=None, description="Traceback of the last failed background extraction")
+
+# Each entry holds full PDFs and the cache is shared by all sessions, so it is bounded
+@st.cache_data(show_spinner=False, max_entries=16)
+def _mask_pdf(_masker: Masker, pdf_bytes: bytes, entities: tuple[tuple[str, str], ...], highlight_only: bool) -> bytes:
+    """Highlight or redact entities in a PDF, cached on the PDF bytes, entities and mode"""
+    doc = pymupdf.open(stream=pdf_bytes, filetype="pdf")
+    pii_entities = [PIIEntityLite(text=text, type=EntityType(entity_type)) for text, entity_type in entities]
+    if highlight_only:
+        return _masker.highlight_pii(doc, pii_entities)
+    return _masker.redact_pii(doc, pii_entities)
+
+# Bounded like `_mask_pdf`, each entry holds a base64 copy of a PDF
+@st.cache_data(show_spinner=False, max_entries=16)
+def _pdf_iframe_html(pdf: bytes) -> str:
+    """Build the iframe embedding a PDF, cached so the base64 encoding runs once per PDF"""
+    base64_pdf = base64.b64encode(pdf).decode('utf-8')
+
+    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}#zoom=125" width="100%" height="2000" type="application/pdf"></iframe>'
+    return f'<div class="fullwidth"> {pdf_display} </div>'
 
 class MaskItApp:
     def __init__(self):
         if "session_state" not in st.session_state:
             st.session_state.session_state = SessionState()
-        self.masker = Masker(self.state.llm_provider)
+        self.masker = Masker(self.state.llm_provider, api_key=self.state.api_key, llm=self._get_llm(),
+                             page_text_cache=self.state.page_text_cache, page_chars_cache=self.state.page_chars_cache)
     
     @property
     def state(self):
         return st.session_state.session_state
     
+    def _get_llm(self):
+        """Return the LLM client for the selected provider, only creating it when provider or API key change"""
+        llm_key = (self.state.llm_provider, self.state.api_key)
+        if self.state.llm is None or self.state.llm_key != llm_key:
+            self.state.llm = get_llm(*llm_key)
+            self.state.llm_key = llm_key
+        return self.state.llm
+    
     def _display_steps(self):
         st.markdown("**Steps:** ")
         st.markdown("1. Configure redaction options below")
@@ -52,7 +93,6 @@ class MaskItApp:
             if self.state.llm_provider == LLMProvider.OPENAI:
                 self.state.api_key = st.text_input("Enter OpenAI API key", type="password")
                 if self.state.api_key:
-                    settings.openai_api_key = self.state.api_key
                     st.success("✓ API key set")
                 else:
                     st.warning("⚠ Enter your OpenAI API key to proceed")
@@ -64,15 +104,12 @@ class MaskItApp:
             self.state.to_page_no = st.text_input("To page number", value="")
             
             st.divider()
-            if st.button("Extract PII", use_container_width=True):
+            if st.button("Extract PII", use_container_width=True, disabled=self.state.extraction is not None):
                 print("Extracting PIIs...")
-                self.state.entities = self.extract_pii()
+                self.extract_pii()
     
-    def _render_pdf(self, pdf: BytesIO | None):
-        base64_pdf = base64.b64encode(pdf.getvalue()).decode('utf-8')
-
-        pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}#zoom=125" width="100%" height="2000" type="application/pdf"></iframe>'
-        st.markdown(f'<div class="fullwidth"> {pdf_display} </div>', unsafe_allow_html=True)
+    def _render_pdf(self, pdf: bytes | None):
+        st.markdown(_pdf_iframe_html(pdf), unsafe_allow_html=True)
     
     def render_main_section(self):
         """Render main upload and process section"""
@@ -80,10 +117,12 @@ class MaskItApp:
         self.state.input_pdf = st.file_uploader("Upload PDF file", type=["pdf"])
             
         if self.state.input_pdf:
+            # Reads the upload and invalidates the cached document and page text if a different file was uploaded
+            self._load_doc()
             tab1, tab2, tab3 = st.tabs(["Preview", "PII Highlight", "Redacted PDF"])
             with tab1:
                 st.subheader("PDF Preview")
-                self._render_pdf(self.state.input_pdf)
+                self._render_pdf(self.state.pdf_bytes)
             
             with tab2:
                 st.subheader("PII Highlight")
@@ -98,40 +137,85 @@ class MaskItApp:
         else:
             st.info("📤 Upload a PDF file to begin")
     
-    def extract_pii(self) -> list[PIIEntity] | None:
-        """Extract PII from uploaded PDF and highlight them"""
-        with st.spinner("Extracting PIIs..."):
-            try:
-                self.state.input_pdf.seek(0)
-                doc = pymupdf.open(stream=self.state.input_pdf.read(), filetype="pdf")
-                entities = self.masker.extract_pii(doc,
-                                                   from_page_no=self.state.from_page_no, 
-                                                   to_page_no=self.state.to_page_no)
-
-                return entities
-            except Exception as e:
-                st.error(f"❌ Error extracting PIIs: {str(e)}")
-                st.code(traceback.format_exc(), language="python")
-                return None
+    def _open_doc(self) -> pymupdf.Document:
+        return pymupdf.open(stream=self.state.pdf_bytes, filetype="pdf")
+    
+    def _load_doc(self) -> pymupdf.Document:
+        """Open the uploaded PDF once and reuse it until a different file is uploaded"""
+        file_id = self.state.input_pdf.file_id
+        if file_id != self.state.pdf_file_id:
+            self.state.pdf_file_id = file_id
+            self.state.pdf_bytes = self.state.input_pdf.getvalue()
+            self.state.doc = self._open_doc()
+            # Clear in place, the masker holds references to these dicts
+            self.state.page_text_cache.clear()
+            self.state.page_chars_cache.clear()
+            # Entities belong to the previous file. A pending extraction keeps appending to the list it
+            # was started with, which is dropped here, so its results are ignored
+            self.state.extraction = None
+            self.state.extraction_error = None
+            self.state.entities = None
+        return self.state.doc
+    
+    def extract_pii(self):
+        """Start extracting PII from uploaded PDF in the background, entities are added to the state as they arrive"""
+        try:
+            # Page text is read here since pymupdf isn't thread safe, only the LLM calls run in the background
+            doc = self._load_doc()
+            page_kwargs = {"from_page_no": self.state.from_page_no, "to_page_no": self.state.to_page_no}
+            regex_entities = self.masker.regex_pii(doc, **page_kwargs)
+            page_texts, full_text = self.masker.get_page_texts(doc, **page_kwargs)
+        except Exception as e:
+            st.error(f"❌ Error extracting PIIs: {str(e)}")
+            st.code(traceback.format_exc(), language="python")
+            return
+        
+        self.state.entities = []
+        self.state.extraction_error = None
+        # Runs on the event loop shared by all sessions, the cached LLM clients are bound to it
+        self.state.extraction = submit_coroutine(self._acollect_pii(page_texts, full_text, regex_entities, self.state.entities))
+    
+    async def _acollect_pii(self, page_texts: list[str], full_text: str, regex_entities: list[PIIEntityLite],
+                            entities: list[PIIEntityLite]):
+        """Append streamed PIIs to `entities`. Runs on the background event loop, so must not call Streamlit"""
+        # Regex extracted entities are yielded first, so they show up right away
+        async for entity in self.masker.astream_pii_from_pages(page_texts, full_text, regex_entities):
+            entities.append(entity)
+    
+    @st.fragment(run_every=1)
+    def _render_extraction_progress(self):
+        """Poll the background extraction, only rendered (and so only polling) while it runs"""
+        extraction = self.state.extraction
+        if extraction is not None and not extraction.done():
+            st.caption(f"⏳ Extracting PIIs... found {len(self.state.entities)} so far")
+            for entity in list(self.state.entities):
+                st.write(f"**{entity.type}**: {entity.text}")
+            return
+        
+        if extraction is not None:
+            self.state.extraction = None
+            if extraction.exception() is not None:
+                self.state.entities = None
+                self.state.extraction_error = "".join(traceback.format_exception(extraction.exception()))
+        # Rerun the whole app, so the highlighted and redacted PDFs are refreshed
+        st.rerun()
+    
+    @staticmethod
+    def _entities_key(entities: list[PIIEntityLite] | None) -> tuple[tuple[str, str], ...]:
+        return tuple((entity.text, entity.type.value) for entity in entities or [])
     
-    def highlight_pii(self, entities: list[PIIEntity]) -> BytesIO | None:
+    def highlight_pii(self, entities: list[PIIEntityLite]) -> bytes | None:
         """Highlight extracted PIIs in the PDF preview"""
         try:
-            self.state.input_pdf.seek(0)
-            doc = pymupdf.open(stream=self.state.input_pdf.read(), filetype="pdf")
-            highlighted_pdf = self.masker.highlight_pii(doc, entities)
-            return BytesIO(highlighted_pdf)
+            return _mask_pdf(self.masker, self.state.pdf_bytes, self._entities_key(entities), highlight_only=True)
         except Exception as e:
             st.error(f"❌ Error highlighting PIIs: {str(e)}")
             st.code(traceback.format_exc(), language="python")
     
-    def redact_pii(self, entities: list[PIIEntity]) -> BytesIO | None:
+    def redact_pii(self, entities: list[PIIEntityLite]) -> bytes | None:
         """Redact extracted PIIs and return redacted PDF bytes"""
         try:
-            self.state.input_pdf.seek(0)
-            doc = pymupdf.open(stream=self.state.input_pdf.read(), filetype="pdf")
-            redacted_pdf = self.masker.redact_pii(doc, entities)
-            return BytesIO(redacted_pdf)
+            return _mask_pdf(self.masker, self.state.pdf_bytes, self._entities_key(entities), highlight_only=False)
         except Exception as e:
             st.error(f"❌ Error redacting PIIs: {str(e)}")
             st.code(traceback.format_exc(), language="python")
@@ -142,7 +226,12 @@ class MaskItApp:
         st.divider()
         
         # display entities is present
-        if self.state.entities:
+        if self.state.extraction is not None:
+            self._render_extraction_progress()
+        elif self.state.extraction_error:
+            st.error("❌ Error extracting PIIs")
+            st.code(self.state.extraction_error, language="python")
+        elif self.state.entities:
             for entity in self.state.entities:
                 st.write(f"**{entity.type}**: {entity.text}")
         else:
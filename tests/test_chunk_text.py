@@ -0,0 +1,40 @@
+import pytest
+
+from src.maskit.maskit import Masker
+from src.types import LLMProvider
+
+
+@pytest.fixture
+def masker():
+    # Ollama counts tokens from the text length, so no tokenizer is downloaded
+    return Masker(LLMProvider.OLLAMA, llm=object())
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "short text",
+    "\n\n".join(f"Paragraph {i} about John Smith, who lives at {i} Main Street." for i in range(50)),
+    # A single huge paragraph, split on lines then words
+    "\n".join(f"Line {i} " + "word " * 30 for i in range(40)),
+    "word " * 500,
+    # Separators at the edges and repeated
+    "\n\n\n" + "abc def\n\n\n\n" * 40 + " ",
+    # Words longer than a chunk (e.g. a base64 blob)
+    "start " + "x" * 1000 + " end",
+    "é" * 1000,
+], ids=["empty", "short", "paragraphs", "huge-paragraph", "words", "edge-separators", "huge-word", "non-ascii"])
+@pytest.mark.parametrize("max_tokens", [1, 5, 20, 100])
+def test_chunk_text(masker, text, max_tokens):
+    chunks = masker._chunk_text(text, max_tokens)
+
+    assert "".join(chunks) == text
+    assert all(masker._count_tokens(chunk) <= max_tokens for chunk in chunks)
+    assert all(chunks) or chunks == [""]
+
+
+def test_chunk_text_splits_on_paragraphs_first(masker):
+    paragraphs = [f"Paragraph {i}. " + "word " * 10 for i in range(10)]
+    chunks = masker._chunk_text("\n\n".join(paragraphs), masker._count_tokens(paragraphs[0] + "\n\n") * 2)
+
+    assert len(chunks) == 5
+    assert all(chunk.startswith("Paragraph") for chunk in chunks)
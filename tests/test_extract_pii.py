@@ -0,0 +1,64 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pymupdf
+import pytest
+
+from src.maskit.maskit import EntityType, Masker, PIIEntities, PIIEntityLite
+from src.types import LLMProvider
+
+
+class LoopBoundLLM:
+    """Fake LLM whose client, like a pooled HTTP connection, is bound to the event loop it was first used in"""
+    def __init__(self):
+        self.loop = None
+        self.calls = 0
+
+    def with_structured_output(self, schema):
+        return self
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.loop = loop
+        if self.loop is not loop or self.loop.is_closed():
+            raise RuntimeError("Event loop is closed")
+        self.calls += 1
+
+    async def ainvoke(self, messages):
+        self._check_loop()
+        return PIIEntities.model_validate({"entities": [{"text": "John Smith", "type": "name"}]})
+
+    async def astream(self, messages):
+        self._check_loop()
+        yield {"entities": [{"text": "John Smith", "type": "name"}]}
+
+
+@pytest.fixture
+def doc():
+    doc = pymupdf.open()
+    for page_no in range(3):
+        doc.new_page().insert_text((72, 72), f"Page {page_no}: John Smith, john@example.com")
+    return doc
+
+
+@pytest.mark.parametrize("max_batch_tokens", [Masker.MAX_BATCH_TOKENS, 0], ids=["single-call", "per-page"])
+def test_extract_pii_twice(doc, max_batch_tokens):
+    llm = LoopBoundLLM()
+    masker = Masker(LLMProvider.OLLAMA, llm=llm)
+    masker.MAX_BATCH_TOKENS = max_batch_tokens
+    expected = {PIIEntityLite(text="john@example.com", type=EntityType.EMAIL),
+                PIIEntityLite(text="John Smith", type=EntityType.NAME)}
+
+    # From the main thread, from a new thread each time (like the app), and from a running loop (like a notebook)
+    assert set(masker.extract_pii(doc)) == expected
+    assert set(masker.extract_pii(doc)) == expected
+    for _ in range(2):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert set(executor.submit(masker.extract_pii, doc).result()) == expected
+
+    async def _from_running_loop():
+        return masker.extract_pii(doc)
+
+    assert set(asyncio.run(_from_running_loop())) == expected
+    assert llm.calls >= 5
@@ -0,0 +1,86 @@
+import pymupdf
+import pytest
+
+from src.maskit.maskit import EntityType, Masker, PIIEntityLite
+from src.types import LLMProvider
+
+
+def _name(text: str) -> PIIEntityLite:
+    return PIIEntityLite(text=text, type=EntityType.NAME)
+
+
+def _redacted_text(lines: list[str], entities: list[PIIEntityLite], rotation: int = 0) -> str:
+    """Write each line on a new page, redact the entities and return the text left on the page"""
+    doc = pymupdf.open()
+    page = doc.new_page()
+    for line_index, line in enumerate(lines):
+        page.insert_text((72, 72 + 20 * line_index), line)
+    page.set_rotation(rotation)
+
+    masker = Masker(LLMProvider.OLLAMA, llm=object())
+    redacted = pymupdf.open(stream=masker.redact_pii(doc, entities), filetype="pdf")
+    return redacted[0].get_text()
+
+
+@pytest.mark.parametrize("lines, entities, redacted, kept", [
+    # Case-different match
+    (["Contact JOHN SMITH today"], [_name("John Smith")], ["JOHN", "SMITH"], ["Contact", "today"]),
+    # Wrapped across two lines, the text around it on both lines is kept
+    (["Contact John", "Smith today"], [_name("John Smith")], ["John", "Smith"], ["Contact", "today"]),
+    # Substring entity next to a longer one
+    (["John Smith and Jane Smith"], [_name("Smith"), _name("John Smith")], ["John", "Smith"], ["and", "Jane"]),
+    (["Jane Smith-Jones, Jane"], [_name("Jane"), _name("Jane Smith-Jones")], ["Jane", "Smith-Jones"], [","]),
+    # Whitespace inside the entity doesn't have to match the page
+    (["Contact John   Smith today"], [_name("John Smith")], ["John", "Smith"], ["Contact", "today"]),
+    (["Mail john@example.com now"], [PIIEntityLite(text="john@example.com", type=EntityType.EMAIL)], ["john@example.com"], ["Mail", "now"]),
+])
+def test_redact_pii(lines, entities, redacted, kept):
+    text = _redacted_text(lines, entities)
+    for word in redacted:
+        assert word not in text
+    for word in kept:
+        assert word in text
+
+
+@pytest.mark.parametrize("rotation", [90, 180, 270])
+def test_redact_pii_rotated_page(rotation):
+    text = _redacted_text(["Contact John Smith today", "Other line"], [_name("John Smith")], rotation)
+    assert "John" not in text and "Smith" not in text
+    assert "Contact" in text and "today" in text and "Other line" in text
+
+
+def test_redact_pii_without_entities():
+    assert "John Smith" in _redacted_text(["Contact John Smith today"], [])
+
+
+def test_find_pii_instances_one_rect_per_line():
+    doc = pymupdf.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Contact John")
+    page.insert_text((72, 92), "Smith today")
+    masker = Masker(LLMProvider.OLLAMA, llm=object())
+    entities = [_name("John Smith")]
+
+    instances = masker._find_pii_instances(page, masker._build_pii_pattern(entities), entities)
+
+    assert [entity for _, entity in instances] == entities * 2
+    (first, _), (second, _) = instances
+    assert first.y1 <= second.y0
+    assert page.get_textbox(first).strip() == "John"
+    assert page.get_textbox(second).strip() == "Smith"
+
+
+def test_unique_by_text():
+    entities = [_name("Smith"), _name("john smith"), _name("John  Smith"), _name("John Smith Jr")]
+    assert Masker._unique_by_text(entities) == [_name("John Smith Jr"), _name("John  Smith"), _name("Smith")]
+
+
+def test_build_pii_pattern():
+    entities = [_name("John Smith"), PIIEntityLite(text="a.b@c.com", type=EntityType.EMAIL), _name("  ")]
+    pattern = Masker._build_pii_pattern(entities)
+
+    assert pattern.fullmatch("JOHN \n SMITH").lastgroup == "e0"
+    assert pattern.fullmatch("a.b@c.com").lastgroup == "e1"
+    # Entity text is escaped
+    assert pattern.fullmatch("aXb@c.com") is None
+    assert Masker._build_pii_pattern([_name(" ")]) is None
@@ -0,0 +1,88 @@
+import pytest
+
+from src.maskit.maskit import EntityType, Masker, PIIEntityLite, _luhn_valid
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("call +14155552671 now", "+14155552671"),
+    ("call +44 20 7946 0958 now", "+44 20 7946 0958"),
+    ("call +1 415 555 2671 now", "+1 415 555 2671"),
+    ("call (415) 555-2671 now", "(415) 555-2671"),
+    ("call 1 (800) 555-0199 now", "1 (800) 555-0199"),
+    ("call 415-555-2671 now", "415-555-2671"),
+    ("call 415.555.2671 now", "415.555.2671"),
+    ("call 1-800-555-0199 now", "1-800-555-0199"),
+    ("call 4155552671 now", "4155552671"),
+    ("call 555-1234.", "555-1234"),
+])
+def test_phone_matched(text, expected):
+    assert Masker._regex_pii(text) == [PIIEntityLite(text=expected, type=EntityType.PHONE)]
+
+
+@pytest.mark.parametrize("text", [
+    "Invoice 2024-001-0001",
+    "order ref 12 345 6789",
+    "order ref 2024-0001",
+    "date 2024-01-15",
+    "amount 12.345.678",
+    "id 1234567890",
+    "version 1.2.3",
+    "Invoice #123-4567",
+    "Invoice #555-1234",
+    "ref 123-4567",
+])
+def test_phone_not_matched(text):
+    assert Masker._regex_pii(text) == []
+
+
+@pytest.mark.parametrize("digits, valid", [
+    ("4111111111111111", True),
+    ("378282246310005", True),
+    ("4111111111111112", False),
+    ("378282246310006", False),
+])
+def test_luhn_valid(digits, valid):
+    assert _luhn_valid(digits) is valid
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("card 4111 1111 1111 1111", ["4111 1111 1111 1111"]),
+    ("card 4111-1111-1111-1111", ["4111-1111-1111-1111"]),
+    ("card 378282246310005", ["378282246310005"]),
+    ("card 3782 822463 10005", ["3782 822463 10005"]),
+    # Followed by the expiry date or other digit groups
+    ("card 4111 1111 1111 1111 12/25", ["4111 1111 1111 1111"]),
+    ("card 4111-1111-1111-1111 1225", ["4111-1111-1111-1111"]),
+    ("card 4111111111111111 12 25", ["4111111111111111"]),
+    # Luhn invalid numbers are neither account numbers, nor phone numbers
+    ("card 4111 1111 1111 1112", []),
+    ("card 4111-1111-1111-1112", []),
+    # Too short / too long
+    ("card 41111111111111", []),
+    ("card 41111111111111111111", []),
+])
+def test_account_number(text, expected):
+    assert Masker._regex_pii(text) == [PIIEntityLite(text=number, type=EntityType.ACCOUNT_NUMBER) for number in expected]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("mail john.doe@example.co.uk today", "john.doe@example.co.uk"),
+    ("mail first+tag@mail-host.com.", "first+tag@mail-host.com"),
+])
+def test_email(text, expected):
+    assert Masker._regex_pii(text) == [PIIEntityLite(text=expected, type=EntityType.EMAIL)]
+
+
+def test_mixed_text():
+    text = "John, john@example.com, (415) 555-2671, card 4111 1111 1111 1111, invoice 2024-001-0001"
+    assert set(Masker._regex_pii(text)) == {
+        PIIEntityLite(text="john@example.com", type=EntityType.EMAIL),
+        PIIEntityLite(text="(415) 555-2671", type=EntityType.PHONE),
+        PIIEntityLite(text="4111 1111 1111 1111", type=EntityType.ACCOUNT_NUMBER),
+    }
+
+
+@pytest.mark.parametrize("pii_type", ["names", "emails", "phone numbers", "addresses", "account numbers"])
+def test_system_prompt_asks_for_all_pii_types(pii_type):
+    # Regex extraction misses some formats, so the LLM must still report every PII type as a fallback
+    assert pii_type in Masker.SYSTEM_MESSAGE["content"]